@@ -1,12 +1,29 @@
 """Flask application factory."""
+import logging
 import os
+from functools import lru_cache
 from flask import Flask
+from flask_caching import Cache
 from flask_cors import CORS
 from flask_pymongo import PyMongo
+from pymongo.errors import PyMongoError
 
 from config import config
 
+logger = logging.getLogger(__name__)
+
 mongo = PyMongo()
+cache = Cache()
+
+DEFAULT_ORIGINS = frozenset({"http://localhost:3000", "http://localhost:5173"})
+
+
+@lru_cache(maxsize=None)
+def _parse_allowed_origins(allowed_origins):
+    """Combine the default origins with a comma-separated ALLOWED_ORIGINS value."""
+    # Filter out empty strings and combine with defaults
+    origins = {origin.strip() for origin in allowed_origins.split(',') if origin.strip()}
+    return tuple(sorted(DEFAULT_ORIGINS | origins))
 
 
 def create_app(config_name=None):
@@ -17,13 +34,8 @@ def create_app(config_name=None):
     app = Flask(__name__)
     app.config.from_object(config[config_name])
     
-    # Get allowed origins from environment or use defaults
-    allowed_origins = os.environ.get('ALLOWED_ORIGINS', '').split(',')
-    default_origins = ["http://localhost:3000", "http://localhost:5173"]
-    
-    # Filter out empty strings and combine with defaults
-    allowed_origins = [origin.strip() for origin in allowed_origins if origin.strip()]
-    all_origins = list(set(default_origins + allowed_origins))
+    # Get allowed origins from environment or use defaults, parsed once per value
+    all_origins = list(_parse_allowed_origins(os.environ.get('ALLOWED_ORIGINS', '')))
     
     # Initialize extensions
     CORS(app, resources={
@@ -31,11 +43,30 @@ def create_app(config_name=None):
             "origins": all_origins,
             "methods": ["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"],
             "allow_headers": ["Content-Type", "Authorization"],
-            "supports_credentials": True
+            "supports_credentials": True,
+            # Let browsers cache preflight responses for a day
+            "max_age": 86400
         }
     })
     
-    mongo.init_app(app)
+    mongo.init_app(
+        app,
+        maxPoolSize=app.config.get('MONGO_MAX_POOL_SIZE', 100),
+        minPoolSize=app.config.get('MONGO_MIN_POOL_SIZE', 0),
+        waitQueueTimeoutMS=app.config.get('MONGO_WAIT_QUEUE_TIMEOUT_MS'),
+        maxIdleTimeMS=app.config.get('MONGO_MAX_IDLE_TIME_MS'),
+        serverSelectionTimeoutMS=app.config.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 30000)
+    )
+    cache.init_app(app)
+    
+    # Create database indexes (idempotent)
+    if app.config.get('CREATE_INDEXES'):
+        from app.models import ImageModel, PersonModel
+        try:
+            ImageModel.create_indexes(mongo.db)
+            PersonModel.create_indexes(mongo.db)
+        except PyMongoError as e:
+            logger.warning(f"Could not create database indexes: {str(e)}")
     
     # Initialize Cloudinary
     from app.services.cloudinary_service import init_cloudinary
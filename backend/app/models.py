@@ -1,23 +1,40 @@
 """Database models and schemas."""
 from datetime import datetime
 from bson import ObjectId
+from pymongo.collation import Collation
+
+# Case-insensitive comparison for person names
+NAME_COLLATION = Collation(locale='en', strength=2)
 
 
 class PersonModel:
     """Person model for MongoDB."""
     
     @staticmethod
-    def create_person(name, face_encoding=None, thumbnail_url=None):
+    def create_person(name, face_encoding=None, thumbnail_url=None, now=None):
         """Create a new person document."""
+        from app.services.face_recognition_service import pack_encoding
+        
+        now = now or datetime.utcnow()
         return {
             'name': name,
-            'face_encodings': [face_encoding] if face_encoding else [],
+            'face_encodings': [pack_encoding(face_encoding)] if face_encoding is not None else [],
             'thumbnail_url': thumbnail_url,
             'image_count': 0,
-            'created_at': datetime.utcnow(),
-            'updated_at': datetime.utcnow()
+            'created_at': now,
+            'updated_at': now
         }
     
+    @staticmethod
+    def create_indexes(db):
+        """Create the indexes used by people queries."""
+        # Name lookups and the default name sort
+        db.people.create_index('name')
+        # People summary, most images first
+        db.people.create_index([('image_count', -1)])
+        # Names are unique ignoring case; queries must pass NAME_COLLATION to use it
+        db.people.create_index('name', name='name_ci', unique=True, collation=NAME_COLLATION)
+    
     @staticmethod
     def to_response(person):
         """Convert person document to API response."""
@@ -34,22 +51,56 @@ class PersonModel:
 class ImageModel:
     """Image model for MongoDB."""
     
+    @staticmethod
+    def create_indexes(db):
+        """Create the indexes used by image queries."""
+        # Listing filters: identified / unidentified, newest first
+        db.images.create_index([('is_identified', 1), ('has_face', 1), ('created_at', -1)])
+        db.images.create_index([('created_at', -1)])
+        # A person's images, newest first with _id breaking ties for
+        # cursor pagination; also serves person_id lookups and counts
+        db.images.create_index([('person_id', 1), ('created_at', -1), ('_id', -1)])
+        db.images.create_index('cloudinary_public_id')
+        # Uploaded content hash, used to skip re-uploads of the same file
+        db.images.create_index('content_sha256', unique=True, sparse=True)
+    
     @staticmethod
     def create_image(cloudinary_url, cloudinary_public_id, original_filename, 
-                     face_encodings=None, person_id=None, face_locations=None):
-        """Create a new image document."""
-        return {
+                     face_encodings=None, person_id=None, face_locations=None,
+                     content_sha256=None, detection_pending=False, thumbnail_url=None, now=None,
+                     detection_error=None):
+        """
+        Create a new image document.
+        
+        With detection_pending, has_face is None until background face
+        detection has run. A detection_error also leaves the image pending,
+        so it is detected again instead of being stored as having no face. Pass the request's timestamp as now so every
+        document written in a batch shares it. thumbnail_url is stored so
+        matching the image to a person does not rebuild it.
+        """
+        now = now or datetime.utcnow()
+        image = {
             'cloudinary_url': cloudinary_url,
             'cloudinary_public_id': cloudinary_public_id,
+            'thumbnail_url': thumbnail_url,
             'original_filename': original_filename,
             'face_encodings': face_encodings or [],
             'face_locations': face_locations or [],
             'person_id': ObjectId(person_id) if person_id else None,
-            'has_face': bool(face_encodings and len(face_encodings) > 0),
+            'has_face': None if detection_pending or detection_error else bool(face_encodings and len(face_encodings) > 0),
             'is_identified': person_id is not None,
-            'created_at': datetime.utcnow(),
-            'updated_at': datetime.utcnow()
+            'created_at': now,
+            'updated_at': now
         }
+        
+        if detection_error:
+            image['detection_error'] = detection_error
+        
+        # Left out when unknown so the sparse unique index ignores the document
+        if content_sha256:
+            image['content_sha256'] = content_sha256
+        
+        return image
     
     @staticmethod
     def to_response(image, include_person=False):
@@ -59,6 +110,8 @@ class ImageModel:
             'url': image['cloudinary_url'],
             'original_filename': image.get('original_filename'),
             'has_face': image.get('has_face', False),
+            'detection_pending': image.get('has_face', False) is None,
+            'detection_error': image.get('detection_error'),
             'is_identified': image.get('is_identified', False),
             'face_count': len(image.get('face_locations', [])),
             'person_id': str(image['person_id']) if image.get('person_id') else None,
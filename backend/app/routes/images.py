@@ -2,22 +2,63 @@
 from flask import Blueprint, request, jsonify, current_app
 from bson import ObjectId
 from bson.errors import InvalidId
+from pymongo.errors import BulkWriteError
 from datetime import datetime
 from werkzeug.utils import secure_filename
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import os
+import threading
 
 from app import mongo
 from app.models import ImageModel, PersonModel
-from app.services.cloudinary_service import upload_image, delete_image, get_thumbnail_url
-from app.services.face_recognition_service import get_face_service
+from app.services.cloudinary_service import upload_image, delete_image, download_image, get_thumbnail_url
+from app.services.people_cache import get_people_index, bump_people_version
+from app.services.face_pipeline import (
+    add_person_update, apply_person_updates, process_image_faces, enqueue_face_detection,
+    get_configured_face_service, get_detection_queue
+)
+from app.services.stats_cache import invalidate_stats_cache
 
 images_bp = Blueprint('images', __name__)
 
+DUPLICATE_KEY_ERROR = 11000
+
+# Queries for the get_images filter options, built once
+IMAGE_FILTERS = {
+    'all': {},
+    'identified': {'is_identified': True},
+    'unidentified': {'has_face': True, 'is_identified': False}
+}
+
+# Worker pools shared across requests, created on first use
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _get_executor(name, max_workers):
+    """Get or create the named thread pool."""
+    with _executors_lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        return _executors[name]
+
+
+# Allowed upload extensions, read from config once at blueprint registration
+_allowed_extensions = frozenset({'png', 'jpg', 'jpeg', 'gif', 'webp'})
+
+
+@images_bp.record_once
+def _load_allowed_extensions(state):
+    """Cache ALLOWED_EXTENSIONS from the app config."""
+    global _allowed_extensions
+    _allowed_extensions = frozenset(state.app.config.get('ALLOWED_EXTENSIONS', _allowed_extensions))
+
 
 def allowed_file(filename):
     """Check if file extension is allowed."""
-    allowed_extensions = current_app.config.get('ALLOWED_EXTENSIONS', {'png', 'jpg', 'jpeg', 'gif', 'webp'})
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
+    _, dot, extension = filename.rpartition('.')
+    return bool(dot) and extension.lower() in _allowed_extensions
 
 
 @images_bp.route('', methods=['GET'])
@@ -30,32 +71,31 @@ def get_images():
         
         skip = (page - 1) * per_page
         
-        # Build query based on filter
-        query = {}
-        if filter_type == 'identified':
-            query['is_identified'] = True
-        elif filter_type == 'unidentified':
-            query['has_face'] = True
-            query['is_identified'] = False
-        
-        # Get images with pagination
-        images = list(
-            mongo.db.images.find(query)
-            .sort('created_at', -1)
-            .skip(skip)
-            .limit(per_page)
-        )
-        
-        # Get person info for identified images
-        person_ids = [img['person_id'] for img in images if img.get('person_id')]
-        people = {str(p['_id']): p for p in mongo.db.people.find({'_id': {'$in': person_ids}})}
-        
-        # Attach person to images
-        for img in images:
-            if img.get('person_id') and str(img['person_id']) in people:
-                img['person'] = people[str(img['person_id'])]
-        
-        total = mongo.db.images.count_documents(query)
+        # Look up query based on filter
+        query = IMAGE_FILTERS.get(filter_type, IMAGE_FILTERS['all'])
+        
+        # Get a page of images with their person attached in one round-trip
+        images = list(mongo.db.images.aggregate([
+            {'$match': query},
+            {'$sort': {'created_at': -1}},
+            {'$skip': skip},
+            {'$limit': per_page},
+            {'$lookup': {
+                'from': 'people',
+                'localField': 'person_id',
+                'foreignField': '_id',
+                'as': 'person'
+            }},
+            {'$unwind': {'path': '$person', 'preserveNullAndEmptyArrays': True}},
+            # Encodings are never part of the response
+            {'$project': {'face_encodings': 0, 'person.face_encodings': 0}}
+        ]))
+        
+        # An unfiltered count can be answered from collection metadata
+        if query:
+            total = mongo.db.images.count_documents(query)
+        else:
+            total = mongo.db.images.estimated_document_count()
         
         return jsonify({
             'success': True,
@@ -100,7 +140,17 @@ def get_image(image_id):
 
 @images_bp.route('/upload', methods=['POST'])
 def upload_images():
-    """Upload one or more images with face detection."""
+    """
+    Upload one or more images with face detection.
+    
+    Files whose content is already stored are not uploaded or processed
+    again; the existing image is returned with duplicate set.
+    
+    With FACE_DETECTION_ASYNC enabled, images are stored as soon as they are
+    uploaded with has_face set to None, faces are detected in the background
+    and the response is 202 Accepted. Background detection runs on the RQ
+    queue at FACE_DETECTION_QUEUE_URL when set, otherwise in this process.
+    """
     try:
         if 'files' not in request.files:
             return jsonify({'success': False, 'error': 'No files provided'}), 400
@@ -110,98 +160,227 @@ def upload_images():
         if not files or all(f.filename == '' for f in files):
             return jsonify({'success': False, 'error': 'No files selected'}), 400
         
-        face_service = get_face_service(current_app.config.get('FACE_RECOGNITION_TOLERANCE', 0.6))
-        people = list(mongo.db.people.find({'face_encodings': {'$ne': []}}))
+        face_service = get_configured_face_service(current_app.config)
+        detect_async = current_app.config.get('FACE_DETECTION_ASYNC', False)
         
-        results = []
+        # One timestamp for every document written by this batch
+        now = datetime.utcnow()
+        
+        upload_pool = _get_executor('upload', current_app.config.get('UPLOAD_POOL_SIZE', 8))
+        detect_pool = _get_executor('detect', current_app.config.get('FACE_DETECTION_POOL_SIZE', os.cpu_count() or 1))
+        
+        pending = []
         
         for file in files:
             if file and file.filename:
                 if not allowed_file(file.filename):
-                    results.append({
+                    pending.append({
                         'filename': file.filename,
-                        'success': False,
                         'error': 'File type not allowed'
                     })
                     continue
                 
-                original_filename = secure_filename(file.filename)
-                
-                # Read file data for both upload and face detection
+                # Read file data once and share the same buffer between the
+                # upload and face detection, then release werkzeug's copy
                 file_data = file.read()
+                file.close()
                 
-                # Upload to Cloudinary
-                upload_result = upload_image(file_data)
-                
-                if not upload_result['success']:
-                    results.append({
-                        'filename': original_filename,
-                        'success': False,
-                        'error': upload_result.get('error', 'Upload failed')
-                    })
-                    continue
-                
-                # Detect faces
-                face_result = face_service.detect_faces(file_data)
-                
-                face_encodings = face_result.get('face_encodings', [])
-                face_locations = face_result.get('face_locations', [])
-                
-                # Try to match faces to existing people
-                matched_person_id = None
-                if face_encodings:
-                    for encoding in face_encodings:
-                        matched_person_id = face_service.find_matching_person(encoding, people)
-                        if matched_person_id:
-                            break
-                
-                # Create image document
+                pending.append({
+                    'filename': secure_filename(file.filename),
+                    'data': file_data,
+                    'content_sha256': hashlib.sha256(file_data).hexdigest()
+                })
+        
+        # Look up already stored content in one query
+        hashes = [entry['content_sha256'] for entry in pending if 'data' in entry]
+        existing = {
+            img['content_sha256']: img
+            for img in mongo.db.images.find({'content_sha256': {'$in': hashes}}, {'face_encodings': 0})
+        } if hashes else {}
+        
+        # Start Cloudinary uploads and face detection for every new file up
+        # front so upload round-trips overlap with detection of the other files
+        first_seen = {}
+        new_entries = []
+        
+        for entry in pending:
+            if 'data' not in entry:
+                continue
+            
+            content_hash = entry['content_sha256']
+            if content_hash in existing:
+                entry['existing'] = existing[content_hash]
+            elif content_hash in first_seen:
+                entry['duplicate_of'] = first_seen[content_hash]
+            else:
+                first_seen[content_hash] = entry
+                entry['upload'] = upload_pool.submit(upload_image, entry['data'])
+                new_entries.append(entry)
+        
+        if not detect_async and face_service.model == 'cnn':
+            # One batched CNN pass over every new file
+            batch = detect_pool.submit(face_service.detect_faces_batch, [entry['data'] for entry in new_entries])
+            for position, entry in enumerate(new_entries):
+                entry['faces'] = batch
+                entry['batch_position'] = position
+        elif not detect_async:
+            for entry in new_entries:
+                entry['faces'] = detect_pool.submit(face_service.detect_faces, entry['data'])
+        
+        people_index = None if detect_async else get_people_index(face_service)
+        
+        results = []
+        image_docs = []
+        
+        for entry in pending:
+            if 'error' in entry:
+                results.append({
+                    'filename': entry['filename'],
+                    'success': False,
+                    'error': entry['error']
+                })
+                continue
+            
+            original_filename = entry['filename']
+            
+            if 'existing' in entry:
+                image_doc = entry['existing']
+                entry['result'] = {
+                    'filename': original_filename,
+                    'success': True,
+                    'image': image_doc,
+                    'faces_detected': len(image_doc.get('face_locations', [])),
+                    'matched_person': str(image_doc['person_id']) if image_doc.get('person_id') else None,
+                    'duplicate': True
+                }
+                results.append(entry['result'])
+                continue
+            
+            if 'duplicate_of' in entry:
+                entry['result'] = dict(entry['duplicate_of']['result'], filename=original_filename)
+                if entry['result']['success']:
+                    entry['result']['duplicate'] = True
+                results.append(entry['result'])
+                continue
+            
+            upload_result = entry['upload'].result()
+            
+            if not upload_result['success']:
+                # A shared batch still has other images to detect
+                if entry.get('faces') and 'batch_position' not in entry:
+                    entry['faces'].cancel()
+                entry['result'] = {
+                    'filename': original_filename,
+                    'success': False,
+                    'error': upload_result.get('error', 'Upload failed')
+                }
+                results.append(entry['result'])
+                continue
+            
+            face_result = None
+            if not detect_async:
+                face_result = entry['faces'].result()
+                if 'batch_position' in entry:
+                    face_result = face_result[entry['batch_position']]
+            
+            # A failed detection is stored pending, not as having no face,
+            # so redetect_pending.py detects it again
+            if detect_async or not face_result['success']:
                 image_doc = ImageModel.create_image(
                     cloudinary_url=upload_result['url'],
                     cloudinary_public_id=upload_result['public_id'],
+                    thumbnail_url=upload_result.get('thumbnail_url'),
                     original_filename=original_filename,
-                    face_encodings=face_encodings,
-                    face_locations=face_locations,
-                    person_id=str(matched_person_id) if matched_person_id else None
+                    content_sha256=entry['content_sha256'],
+                    detection_pending=True,
+                    detection_error=None if detect_async else face_result['error'],
+                    now=now
                 )
+                image_docs.append(image_doc)
+                entry['image_doc'] = image_doc
                 
-                result = mongo.db.images.insert_one(image_doc)
-                image_doc['_id'] = result.inserted_id
-                
-                # Update person's image count and thumbnail if matched
-                if matched_person_id:
-                    person = mongo.db.people.find_one({'_id': matched_person_id})
-                    update_data = {
-                        'image_count': person.get('image_count', 0) + 1,
-                        'updated_at': datetime.utcnow()
-                    }
-                    
-                    # Set thumbnail if not set
-                    if not person.get('thumbnail_url'):
-                        update_data['thumbnail_url'] = get_thumbnail_url(upload_result['url'])
-                    
-                    # Add face encoding to person if new
-                    if face_encodings:
-                        mongo.db.people.update_one(
-                            {'_id': matched_person_id},
-                            {
-                                '$set': update_data,
-                                '$addToSet': {'face_encodings': face_encodings[0]}
-                            }
-                        )
-                    else:
-                        mongo.db.people.update_one(
-                            {'_id': matched_person_id},
-                            {'$set': update_data}
-                        )
-                
-                results.append({
+                entry['result'] = {
                     'filename': original_filename,
                     'success': True,
-                    'image': ImageModel.to_response(image_doc),
-                    'faces_detected': len(face_encodings),
-                    'matched_person': str(matched_person_id) if matched_person_id else None
-                })
+                    'image': image_doc,
+                    'faces_detected': None,
+                    'matched_person': None
+                }
+                results.append(entry['result'])
+                continue
+            
+            face_encodings = face_result.get('face_encodings', [])
+            face_locations = face_result.get('face_locations', [])
+            
+            # Try to match faces to existing people
+            matched_person_id = face_service.match_faces(face_encodings, people_index)
+            
+            # Create image document
+            image_doc = ImageModel.create_image(
+                cloudinary_url=upload_result['url'],
+                cloudinary_public_id=upload_result['public_id'],
+                thumbnail_url=upload_result.get('thumbnail_url'),
+                original_filename=original_filename,
+                face_encodings=face_encodings,
+                face_locations=face_locations,
+                person_id=str(matched_person_id) if matched_person_id else None,
+                content_sha256=entry['content_sha256'],
+                now=now
+            )
+            
+            image_docs.append(image_doc)
+            entry['image_doc'] = image_doc
+            
+            entry['result'] = {
+                'filename': original_filename,
+                'success': True,
+                'image': image_doc,
+                'faces_detected': len(face_encodings),
+                'matched_person': str(matched_person_id) if matched_person_id else None
+            }
+            results.append(entry['result'])
+        
+        stored_docs = _insert_images(image_docs, results)
+        
+        # Aggregate person updates so each person gets at most one write
+        person_updates = {}
+        for image_doc in stored_docs:
+            if image_doc.get('person_id'):
+                add_person_update(
+                    person_updates, image_doc['person_id'],
+                    image_doc['thumbnail_url'], image_doc['face_encodings']
+                )
+        
+        apply_person_updates(person_updates, now)
+        
+        if stored_docs:
+            invalidate_stats_cache()
+        
+        # Detect faces for stored images once the request no longer needs them
+        stored_ids = {image_doc['_id'] for image_doc in stored_docs}
+        background_jobs = [
+            entry for entry in pending
+            if detect_async and 'image_doc' in entry and entry['image_doc']['_id'] in stored_ids
+        ]
+        queue = get_detection_queue(current_app.config) if background_jobs else None
+        app = current_app._get_current_object()
+        for entry in background_jobs:
+            if queue is not None:
+                try:
+                    enqueue_face_detection(queue, entry['image_doc']['_id'])
+                    continue
+                except Exception as e:
+                    # The images are already stored, so detect the rest of the batch here
+                    current_app.logger.warning(f"Could not queue face detection, running it in process: {str(e)}")
+                    queue = None
+            detect_pool.submit(
+                process_image_faces, app, entry['image_doc']['_id'], entry['data'],
+                entry['image_doc']['thumbnail_url'], face_service
+            )
+        
+        for result in results:
+            if result['success']:
+                result['image'] = ImageModel.to_response(result['image'])
         
         successful = sum(1 for r in results if r['success'])
         
@@ -209,12 +388,49 @@ def upload_images():
             'success': True,
             'message': f'Uploaded {successful} of {len(results)} images',
             'results': results
-        })
+        }), 202 if background_jobs else 200
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _insert_images(image_docs, results):
+    """
+    Insert new image documents in one batch.
+    
+    Images that lose a race with a concurrent upload of the same content hit
+    the unique content_sha256 index; their Cloudinary copy is deleted and
+    their results are marked as failed.
+    
+    Returns:
+        list: The image documents that were stored
+    """
+    if not image_docs:
+        return []
+    
+    try:
+        # insert_many fills in each document's _id
+        mongo.db.images.insert_many(image_docs, ordered=False)
+        return image_docs
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(error.get('code') != DUPLICATE_KEY_ERROR for error in errors):
+            raise
+        
+        failed_indexes = {error['index'] for error in errors}
+        failed_ids = set()
+        for index in failed_indexes:
+            delete_image(image_docs[index]['cloudinary_public_id'])
+            failed_ids.add(image_docs[index]['_id'])
+        
+        for result in results:
+            if result['success'] and result['image']['_id'] in failed_ids:
+                result.update(success=False, error='Image was uploaded concurrently')
+                del result['image']
+        
+        return [image_doc for index, image_doc in enumerate(image_docs) if index not in failed_indexes]
+
+
 @images_bp.route('/<image_id>', methods=['DELETE'])
 def delete_image_route(image_id):
     """Delete an image."""
@@ -239,6 +455,7 @@ def delete_image_route(image_id):
         
         # Delete from database
         mongo.db.images.delete_one({'_id': ObjectId(image_id)})
+        invalidate_stats_cache()
         
         return jsonify({
             'success': True,
@@ -254,24 +471,31 @@ def delete_image_route(image_id):
 @images_bp.route('/<image_id>/assign', methods=['PATCH'])
 def assign_image(image_id):
     """Assign or reassign an image to a person."""
+    # Imported here so read-only workers never load numpy and dlib
+    from app.services.face_recognition_service import pack_encoding
+    
     try:
         data = request.get_json()
         person_id = data.get('person_id')
         
-        image = mongo.db.images.find_one({'_id': ObjectId(image_id)})
+        image_oid = ObjectId(image_id)
+        person_oid = ObjectId(person_id) if person_id else None
+        now = datetime.utcnow()
+        
+        image = mongo.db.images.find_one({'_id': image_oid})
         if not image:
             return jsonify({'success': False, 'error': 'Image not found'}), 404
         
         old_person_id = image.get('person_id')
         
         # Handle unassignment
-        if not person_id:
+        if not person_oid:
             mongo.db.images.update_one(
-                {'_id': ObjectId(image_id)},
+                {'_id': image_oid},
                 {'$set': {
                     'person_id': None,
                     'is_identified': False,
-                    'updated_at': datetime.utcnow()
+                    'updated_at': now
                 }}
             )
             
@@ -281,69 +505,64 @@ def assign_image(image_id):
                     {'_id': old_person_id},
                     {
                         '$inc': {'image_count': -1},
-                        '$set': {'updated_at': datetime.utcnow()}
+                        '$set': {'updated_at': now}
                     }
                 )
             
+            invalidate_stats_cache()
+            
             return jsonify({
                 'success': True,
                 'message': 'Image unassigned successfully'
             })
         
         # Verify person exists
-        person = mongo.db.people.find_one({'_id': ObjectId(person_id)})
+        person = mongo.db.people.find_one({'_id': person_oid})
         if not person:
             return jsonify({'success': False, 'error': 'Person not found'}), 404
         
         # Update image
         mongo.db.images.update_one(
-            {'_id': ObjectId(image_id)},
+            {'_id': image_oid},
             {'$set': {
-                'person_id': ObjectId(person_id),
+                'person_id': person_oid,
                 'is_identified': True,
-                'updated_at': datetime.utcnow()
+                'updated_at': now
             }}
         )
         
         # Update old person's count
-        if old_person_id and old_person_id != ObjectId(person_id):
+        if old_person_id and old_person_id != person_oid:
             mongo.db.people.update_one(
                 {'_id': old_person_id},
                 {
                     '$inc': {'image_count': -1},
-                    '$set': {'updated_at': datetime.utcnow()}
+                    '$set': {'updated_at': now}
                 }
             )
         
-        # Update new person's count and face encoding
-        update_ops = {
-            '$set': {'updated_at': datetime.utcnow()}
-        }
+        # Update new person's count, face encoding and thumbnail in one write
+        update_data = {'updated_at': now}
+        
+        # Set thumbnail if not set
+        if not person.get('thumbnail_url'):
+            update_data['thumbnail_url'] = image.get('thumbnail_url') or get_thumbnail_url(image['cloudinary_url'])
+        
+        update_ops = {'$set': update_data}
         
-        if old_person_id != ObjectId(person_id):
+        if old_person_id != person_oid:
             update_ops['$inc'] = {'image_count': 1}
         
         # Add face encoding to help future matching
-        if image.get('face_encodings') and len(image['face_encodings']) > 0:
-            mongo.db.people.update_one(
-                {'_id': ObjectId(person_id)},
-                {
-                    **update_ops,
-                    '$addToSet': {'face_encodings': image['face_encodings'][0]}
-                }
-            )
-        else:
-            mongo.db.people.update_one(
-                {'_id': ObjectId(person_id)},
-                update_ops
-            )
+        if image.get('face_encodings'):
+            update_ops['$addToSet'] = {'face_encodings': pack_encoding(image['face_encodings'][0])}
         
-        # Set thumbnail if not set
-        if not person.get('thumbnail_url'):
-            mongo.db.people.update_one(
-                {'_id': ObjectId(person_id)},
-                {'$set': {'thumbnail_url': get_thumbnail_url(image['cloudinary_url'])}}
-            )
+        mongo.db.people.update_one({'_id': person_oid}, update_ops)
+        
+        if '$addToSet' in update_ops:
+            bump_people_version()
+        
+        invalidate_stats_cache()
         
         return jsonify({
             'success': True,
@@ -366,15 +585,12 @@ def reprocess_image(image_id):
             return jsonify({'success': False, 'error': 'Image not found'}), 404
         
         # Download image from Cloudinary and reprocess
-        import requests
-        from io import BytesIO
-        
-        response = requests.get(image['cloudinary_url'])
-        if response.status_code != 200:
+        download_result = download_image(image['cloudinary_url'])
+        if not download_result['success']:
             return jsonify({'success': False, 'error': 'Failed to download image'}), 500
         
-        face_service = get_face_service(current_app.config.get('FACE_RECOGNITION_TOLERANCE', 0.6))
-        face_result = face_service.detect_faces(response.content)
+        face_service = get_configured_face_service(current_app.config)
+        face_result = face_service.detect_faces(download_result['data'])
         
         face_encodings = face_result.get('face_encodings', [])
         face_locations = face_result.get('face_locations', [])
@@ -382,11 +598,7 @@ def reprocess_image(image_id):
         # Try to match faces
         matched_person_id = None
         if face_encodings:
-            people = list(mongo.db.people.find({'face_encodings': {'$ne': []}}))
-            for encoding in face_encodings:
-                matched_person_id = face_service.find_matching_person(encoding, people)
-                if matched_person_id:
-                    break
+            matched_person_id = face_service.match_faces(face_encodings, get_people_index(face_service))
         
         # Update image
         old_person_id = image.get('person_id')
@@ -420,6 +632,8 @@ def reprocess_image(image_id):
                 {'$inc': {'image_count': 1}}
             )
         
+        invalidate_stats_cache()
+        
         return jsonify({
             'success': True,
             'message': f'Reprocessed image. Found {len(face_encodings)} face(s).',
@@ -2,11 +2,16 @@
 from flask import Blueprint, request, jsonify
 from bson import ObjectId
 from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
+import base64
+import re
 
 from app import mongo
-from app.models import PersonModel, ImageModel
-from app.services.cloudinary_service import get_thumbnail_url
+from app.models import PersonModel, ImageModel, NAME_COLLATION
+from app.services.cloudinary_service import get_thumbnail_url, delete_images as delete_cloudinary_images
+from app.services.people_cache import bump_people_version
+from app.services.stats_cache import invalidate_stats_cache
 
 people_bp = Blueprint('people', __name__)
 
@@ -22,13 +27,15 @@ def get_people():
         # Build query
         query = {}
         if search:
-            query['name'] = {'$regex': search, '$options': 'i'}
+            # Anchored and escaped so the search is a name prefix, not user regex
+            query['name'] = {'$regex': f'^{re.escape(search)}', '$options': 'i'}
         
         # Sort options
         sort_order = 1 if order == 'asc' else -1
         sort_field = sort_by if sort_by in ['name', 'created_at', 'image_count'] else 'name'
         
-        people = list(mongo.db.people.find(query).sort(sort_field, sort_order))
+        # Encodings grow with every matched image and are never returned
+        people = list(mongo.db.people.find(query, {'face_encodings': 0}).sort(sort_field, sort_order))
         
         return jsonify({
             'success': True,
@@ -44,7 +51,7 @@ def get_people():
 def get_person(person_id):
     """Get a specific person by ID."""
     try:
-        person = mongo.db.people.find_one({'_id': ObjectId(person_id)})
+        person = mongo.db.people.find_one({'_id': ObjectId(person_id)}, {'face_encodings': 0})
         
         if not person:
             return jsonify({'success': False, 'error': 'Person not found'}), 404
@@ -72,7 +79,7 @@ def create_person():
         name = data['name'].strip()
         
         # Check if person with same name exists
-        existing = mongo.db.people.find_one({'name': {'$regex': f'^{name}$', '$options': 'i'}})
+        existing = mongo.db.people.find_one({'name': name}, collation=NAME_COLLATION)
         if existing:
             return jsonify({'success': False, 'error': 'A person with this name already exists'}), 400
         
@@ -80,6 +87,7 @@ def create_person():
         result = mongo.db.people.insert_one(person)
         
         person['_id'] = result.inserted_id
+        invalidate_stats_cache()
         
         return jsonify({
             'success': True,
@@ -87,6 +95,9 @@ def create_person():
             'data': PersonModel.to_response(person)
         }), 201
         
+    except DuplicateKeyError:
+        # Lost a race with a concurrent create of the same name
+        return jsonify({'success': False, 'error': 'A person with this name already exists'}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -100,7 +111,7 @@ def update_person(person_id):
         if not data:
             return jsonify({'success': False, 'error': 'No data provided'}), 400
         
-        person = mongo.db.people.find_one({'_id': ObjectId(person_id)})
+        person = mongo.db.people.find_one({'_id': ObjectId(person_id)}, {'_id': 1})
         if not person:
             return jsonify({'success': False, 'error': 'Person not found'}), 404
         
@@ -112,10 +123,10 @@ def update_person(person_id):
                 return jsonify({'success': False, 'error': 'Name cannot be empty'}), 400
             
             # Check for duplicate name
-            existing = mongo.db.people.find_one({
-                'name': {'$regex': f'^{name}$', '$options': 'i'},
-                '_id': {'$ne': ObjectId(person_id)}
-            })
+            existing = mongo.db.people.find_one(
+                {'name': name, '_id': {'$ne': ObjectId(person_id)}},
+                collation=NAME_COLLATION
+            )
             if existing:
                 return jsonify({'success': False, 'error': 'A person with this name already exists'}), 400
             
@@ -126,7 +137,9 @@ def update_person(person_id):
             {'$set': update_data}
         )
         
-        updated_person = mongo.db.people.find_one({'_id': ObjectId(person_id)})
+        invalidate_stats_cache()
+        
+        updated_person = mongo.db.people.find_one({'_id': ObjectId(person_id)}, {'face_encodings': 0})
         
         return jsonify({
             'success': True,
@@ -136,6 +149,8 @@ def update_person(person_id):
         
     except InvalidId:
         return jsonify({'success': False, 'error': 'Invalid person ID'}), 400
+    except DuplicateKeyError:
+        return jsonify({'success': False, 'error': 'A person with this name already exists'}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -146,19 +161,43 @@ def delete_person(person_id):
     try:
         delete_images = request.args.get('delete_images', 'false').lower() == 'true'
         
-        person = mongo.db.people.find_one({'_id': ObjectId(person_id)})
+        person = mongo.db.people.find_one({'_id': ObjectId(person_id)}, {'_id': 1})
         if not person:
             return jsonify({'success': False, 'error': 'Person not found'}), 404
         
         if delete_images:
-            # Delete all images associated with this person
-            from app.services.cloudinary_service import delete_image
+            # Delete all images associated with this person, 100 per API call
+            images = list(mongo.db.images.find({'person_id': ObjectId(person_id)}, {'cloudinary_public_id': 1}))
+            delete_result = delete_cloudinary_images(
+                [image['cloudinary_public_id'] for image in images if image.get('cloudinary_public_id')]
+            )
             
-            images = mongo.db.images.find({'person_id': ObjectId(person_id)})
-            for image in images:
-                delete_image(image.get('cloudinary_public_id'))
+            # Only drop documents whose Cloudinary copy is gone, so no asset is orphaned
+            gone = {
+                public_id for public_id, status in delete_result['deleted'].items()
+                if status in ('deleted', 'not_found')
+            }
+            deleted_ids = [
+                image['_id'] for image in images
+                if not image.get('cloudinary_public_id') or image['cloudinary_public_id'] in gone
+            ]
+            if deleted_ids:
+                mongo.db.images.delete_many({'_id': {'$in': deleted_ids}})
             
-            mongo.db.images.delete_many({'person_id': ObjectId(person_id)})
+            failed = len(images) - len(deleted_ids)
+            if failed:
+                # Keep the person with the remaining images so the delete can be retried
+                mongo.db.people.update_one(
+                    {'_id': ObjectId(person_id)},
+                    {'$inc': {'image_count': -len(deleted_ids)}, '$set': {'updated_at': datetime.utcnow()}}
+                )
+                invalidate_stats_cache()
+                
+                error = delete_result.get('error') or 'not deleted by Cloudinary'
+                return jsonify({
+                    'success': False,
+                    'error': f'Could not delete {failed} of {len(images)} images, person was kept: {error}'
+                }), 502
         else:
             # Just unassign images from this person
             mongo.db.images.update_many(
@@ -168,6 +207,8 @@ def delete_person(person_id):
         
         # Delete the person
         mongo.db.people.delete_one({'_id': ObjectId(person_id)})
+        bump_people_version()
+        invalidate_stats_cache()
         
         return jsonify({
             'success': True,
@@ -180,26 +221,91 @@ def delete_person(person_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _encode_cursor(image):
+    """Encode an image's sort position as an opaque pagination cursor."""
+    position = f"{image['created_at'].isoformat()}|{image['_id']}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    """
+    Decode a pagination cursor from _encode_cursor.
+    
+    Returns:
+        tuple: (created_at, _id) of the last image on the previous page
+        
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        created_at, image_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), ObjectId(image_id)
+    except (ValueError, InvalidId):
+        raise ValueError('Invalid cursor')
+
+
 @people_bp.route('/<person_id>/images', methods=['GET'])
 def get_person_images(person_id):
-    """Get all images for a specific person."""
+    """
+    Get all images for a specific person, newest first.
+    
+    Pass cursor (empty for the first page, then the returned next_cursor)
+    for keyset pagination, which stays fast on deep pages. Without it,
+    page and per_page select an offset page.
+    """
     try:
-        person = mongo.db.people.find_one({'_id': ObjectId(person_id)})
+        person = mongo.db.people.find_one({'_id': ObjectId(person_id)}, {'face_encodings': 0})
         if not person:
             return jsonify({'success': False, 'error': 'Person not found'}), 404
         
-        page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 20))
+        query = {'person_id': ObjectId(person_id)}
+        sort = [('created_at', -1), ('_id', -1)]
+        
+        if 'cursor' in request.args:
+            if per_page < 1:
+                return jsonify({'success': False, 'error': 'per_page must be at least 1'}), 400
+            
+            cursor = request.args['cursor']
+            if cursor:
+                try:
+                    created_at, last_id = _decode_cursor(cursor)
+                except ValueError as e:
+                    return jsonify({'success': False, 'error': str(e)}), 400
+                
+                # Continue strictly after the last image of the previous page
+                query['$or'] = [
+                    {'created_at': {'$lt': created_at}},
+                    {'created_at': created_at, '_id': {'$lt': last_id}}
+                ]
+            
+            # One extra image tells whether there is a next page without counting
+            images = list(mongo.db.images.find(query, {'face_encodings': 0}).sort(sort).limit(per_page + 1))
+            has_next = len(images) > per_page
+            images = images[:per_page]
+            
+            return jsonify({
+                'success': True,
+                'data': [ImageModel.to_response(img) for img in images],
+                'person': PersonModel.to_response(person),
+                'pagination': {
+                    'per_page': per_page,
+                    'has_next': has_next,
+                    'next_cursor': _encode_cursor(images[-1]) if has_next else None
+                }
+            })
+        
+        page = int(request.args.get('page', 1))
         skip = (page - 1) * per_page
         
         images = list(
-            mongo.db.images.find({'person_id': ObjectId(person_id)})
-            .sort('created_at', -1)
+            mongo.db.images.find(query, {'face_encodings': 0})
+            .sort(sort)
             .skip(skip)
             .limit(per_page)
         )
         
-        total = mongo.db.images.count_documents({'person_id': ObjectId(person_id)})
+        total = mongo.db.images.count_documents(query)
         
         return jsonify({
             'success': True,
@@ -4,22 +4,24 @@ from datetime import datetime, timedelta
 
 from app import mongo
 from app.models import PersonModel, ImageModel
+from app.services.stats_cache import cached_stats
 
 stats_bp = Blueprint('stats', __name__)
 
 
 @stats_bp.route('', methods=['GET'])
+@cached_stats('stats:global')
 def get_stats():
     """Get dashboard statistics."""
     try:
-        # Count totals
-        total_images = mongo.db.images.count_documents({})
-        total_people = mongo.db.people.count_documents({})
+        # The total comes from collection metadata and the filtered counts
+        # from the (is_identified, has_face, created_at) index
+        total_images = mongo.db.images.estimated_document_count()
         identified_images = mongo.db.images.count_documents({'is_identified': True})
-        unidentified_faces = mongo.db.images.count_documents({
-            'has_face': True,
-            'is_identified': False
-        })
+        unidentified_faces = mongo.db.images.count_documents({'is_identified': False, 'has_face': True})
+        
+        # An unfiltered count is answered from collection metadata
+        total_people = mongo.db.people.estimated_document_count()
         
         # Calculate percentages
         identification_rate = (identified_images / total_images * 100) if total_images > 0 else 0
@@ -40,25 +42,28 @@ def get_stats():
 
 
 @stats_bp.route('/recent', methods=['GET'])
+@cached_stats('stats:recent')
 def get_recent():
     """Get recent uploads."""
     try:
         # Get recent images (last 7 days)
         week_ago = datetime.utcnow() - timedelta(days=7)
         
-        recent_images = list(
-            mongo.db.images.find({'created_at': {'$gte': week_ago}})
-            .sort('created_at', -1)
-            .limit(12)
-        )
-        
-        # Get person info for identified images
-        person_ids = [img['person_id'] for img in recent_images if img.get('person_id')]
-        people = {str(p['_id']): p for p in mongo.db.people.find({'_id': {'$in': person_ids}})}
-        
-        for img in recent_images:
-            if img.get('person_id') and str(img['person_id']) in people:
-                img['person'] = people[str(img['person_id'])]
+        # Get recent images with their person attached in one round-trip
+        recent_images = list(mongo.db.images.aggregate([
+            {'$match': {'created_at': {'$gte': week_ago}}},
+            {'$sort': {'created_at': -1}},
+            {'$limit': 12},
+            {'$lookup': {
+                'from': 'people',
+                'localField': 'person_id',
+                'foreignField': '_id',
+                'as': 'person'
+            }},
+            {'$unwind': {'path': '$person', 'preserveNullAndEmptyArrays': True}},
+            # Encodings are never part of the response
+            {'$project': {'face_encodings': 0, 'person.face_encodings': 0}}
+        ]))
         
         return jsonify({
             'success': True,
@@ -70,6 +75,7 @@ def get_recent():
 
 
 @stats_bp.route('/unidentified', methods=['GET'])
+@cached_stats('stats:unidentified')
 def get_unidentified():
     """Get images with unidentified faces."""
     try:
@@ -77,7 +83,7 @@ def get_unidentified():
             mongo.db.images.find({
                 'has_face': True,
                 'is_identified': False
-            })
+            }, {'face_encodings': 0})
             .sort('created_at', -1)
             .limit(12)
         )
@@ -92,11 +98,12 @@ def get_unidentified():
 
 
 @stats_bp.route('/people-summary', methods=['GET'])
+@cached_stats('stats:people-summary')
 def get_people_summary():
     """Get people with most images."""
     try:
         people = list(
-            mongo.db.people.find()
+            mongo.db.people.find({}, {'face_encodings': 0})
             .sort('image_count', -1)
             .limit(8)
         )
@@ -1,12 +1,37 @@
-"""Services package."""
-from .cloudinary_service import upload_image, delete_image, get_thumbnail_url, init_cloudinary
-from .face_recognition_service import FaceRecognitionService, get_face_service
-
-__all__ = [
-    'upload_image',
-    'delete_image', 
-    'get_thumbnail_url',
-    'init_cloudinary',
-    'FaceRecognitionService',
-    'get_face_service'
-]
+"""Services package.
+
+Exports are resolved lazily so importing one service does not pull in the
+others; face_recognition_service in particular loads numpy and dlib.
+"""
+import importlib
+
+_EXPORTS = {
+    'upload_image': 'cloudinary_service',
+    'delete_image': 'cloudinary_service',
+    'delete_images': 'cloudinary_service',
+    'download_image': 'cloudinary_service',
+    'get_thumbnail_url': 'cloudinary_service',
+    'init_cloudinary': 'cloudinary_service',
+    'EncodingIndex': 'face_recognition_service',
+    'FaceRecognitionService': 'face_recognition_service',
+    'get_face_service': 'face_recognition_service',
+    'pack_encoding': 'face_recognition_service',
+    'unpack_encoding': 'face_recognition_service',
+    'get_people_index': 'people_cache',
+    'bump_people_version': 'people_cache',
+    'add_person_update': 'face_pipeline',
+    'apply_person_updates': 'face_pipeline',
+    'process_image_faces': 'face_pipeline',
+    'run_face_pipeline': 'face_pipeline',
+    'get_configured_face_service': 'face_pipeline',
+    'get_detection_queue': 'face_pipeline'
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(f'.{_EXPORTS[name]}', __name__)
+    return getattr(module, name)
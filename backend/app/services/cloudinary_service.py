@@ -2,8 +2,31 @@
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
+import cloudinary.utils
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from werkzeug.utils import secure_filename
 
+try:
+    from cloudinary.api_client import call_api
+except ImportError:  # Only in the SDK versions whose pools are resized below
+    call_api = None
+
+logger = logging.getLogger(__name__)
+
+# Most public IDs the Admin API deletes per call
+DELETE_BATCH_SIZE = 100
+
+# Keep-alive connections to Cloudinary's CDN, shared by all downloads
+_http = requests.Session()
+_http.mount('https://', HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504))
+))
+
 
 def init_cloudinary(config):
     """Initialize Cloudinary with configuration."""
@@ -13,6 +36,24 @@ def init_cloudinary(config):
         api_secret=config.get('CLOUDINARY_API_SECRET'),
         secure=True
     )
+    
+    # The SDK's upload and admin API calls share module-level urllib3 pools
+    # that keep a single connection per host, so concurrent uploads would
+    # reopen TLS connections. Size the pool for every upload thread. urllib3
+    # only retries POSTs on connection errors, so an upload is never sent twice.
+    # The pools are private to the SDK, pinned in requirements.txt for this.
+    modules = (cloudinary.uploader, call_api)
+    if not hasattr(cloudinary.utils, 'get_http_connector') or not all(hasattr(m, '_http') for m in modules):
+        logger.warning('Cloudinary SDK has no module-level HTTP pools, keeping its default pool size')
+        return
+    
+    api_http = cloudinary.utils.get_http_connector(cloudinary.config(), dict(
+        cloudinary.CERT_KWARGS,
+        maxsize=config.get('UPLOAD_POOL_SIZE', 8),
+        retries=Retry(total=3, backoff_factor=0.3)
+    ))
+    for module in modules:
+        module._http = api_http
 
 
 def upload_image(file, folder='image-organizer'):
@@ -20,11 +61,12 @@ def upload_image(file, folder='image-organizer'):
     Upload an image to Cloudinary.
     
     Args:
-        file: File object or file path
+        file: Image bytes, file object or file path. Bytes are sent as-is,
+              while file objects are read fully into memory by the SDK.
         folder: Cloudinary folder to store the image
         
     Returns:
-        dict: Upload result containing url and public_id
+        dict: Upload result containing url, thumbnail_url and public_id
     """
     try:
         result = cloudinary.uploader.upload(
@@ -39,6 +81,7 @@ def upload_image(file, folder='image-organizer'):
         return {
             'success': True,
             'url': result['secure_url'],
+            'thumbnail_url': get_thumbnail_url(result['secure_url']),
             'public_id': result['public_id'],
             'width': result.get('width'),
             'height': result.get('height'),
@@ -74,6 +117,58 @@ def delete_image(public_id):
         }
 
 
+def delete_images(public_ids):
+    """
+    Delete several images from Cloudinary with the bulk Admin API.
+    
+    Args:
+        public_ids: Cloudinary public IDs of the images
+        
+    Returns:
+        dict: Deletion result with the per-image status from Cloudinary
+    """
+    deleted = {}
+    try:
+        for start in range(0, len(public_ids), DELETE_BATCH_SIZE):
+            result = cloudinary.api.delete_resources(public_ids[start:start + DELETE_BATCH_SIZE])
+            deleted.update(result.get('deleted', {}))
+        return {
+            'success': True,
+            'deleted': deleted
+        }
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e),
+            'deleted': deleted
+        }
+
+
+def download_image(url, timeout=30):
+    """
+    Download an image from Cloudinary.
+    
+    Args:
+        url: Cloudinary URL of the image
+        timeout: Request timeout in seconds
+        
+    Returns:
+        dict: Download result containing the image data
+    """
+    try:
+        response = _http.get(url, timeout=timeout)
+        response.raise_for_status()
+        return {
+            'success': True,
+            'data': response.content
+        }
+    except requests.RequestException as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+
 def get_thumbnail_url(url, width=200, height=200):
     """
     Generate a thumbnail URL for an image.
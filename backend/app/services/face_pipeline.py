@@ -0,0 +1,286 @@
+"""Face detection and matching pipeline for uploaded images."""
+from datetime import datetime
+from pymongo import UpdateOne
+import logging
+
+from app import mongo
+from app.services.cloudinary_service import download_image, get_thumbnail_url
+from app.services.people_cache import get_people_index, bump_people_version
+from app.services.stats_cache import invalidate_stats_cache
+
+logger = logging.getLogger(__name__)
+
+DETECTION_QUEUE_NAME = 'face-detection'
+
+# Seconds RQ waits before each retry of a failed detection job
+DETECTION_RETRY_INTERVALS = [10, 60, 300]
+
+# RQ queues keyed by Redis URL, created on first use
+_queues = {}
+
+# App used by run_face_pipeline inside RQ worker processes
+_worker_app = None
+
+
+def get_configured_face_service(config):
+    """
+    Get the face service with the face settings from an app config.
+
+    Args:
+        config: Flask app config
+    """
+    # Imported here so read-only workers never load numpy and dlib
+    from app.services.face_recognition_service import get_face_service
+
+    return get_face_service(
+        config.get('FACE_RECOGNITION_TOLERANCE', 0.6),
+        config.get('FACE_INDEX_HNSW_THRESHOLD', 10000),
+        config.get('FACE_DETECTION_MODEL', 'hog'),
+        config.get('FACE_DETECTION_MAX_IMAGE_SIZE', 1600)
+    )
+
+
+def get_detection_queue(config):
+    """
+    Get the RQ queue for background face detection.
+
+    Args:
+        config: Flask app config
+
+    Returns:
+        Queue or None: None when FACE_DETECTION_QUEUE_URL is not set and
+                       detection runs in the web process instead
+    """
+    url = config.get('FACE_DETECTION_QUEUE_URL')
+    if not url:
+        return None
+
+    queue = _queues.get(url)
+    if queue is None:
+        # Optional dependencies, only needed with a queue configured
+        from redis import Redis
+        from rq import Queue
+
+        queue = _queues[url] = Queue(DETECTION_QUEUE_NAME, connection=Redis.from_url(url))
+
+    return queue
+
+
+def enqueue_face_detection(queue, image_id):
+    """
+    Queue background face detection for a stored image, retried when it fails.
+
+    Args:
+        queue: RQ queue from get_detection_queue
+        image_id: ID of an image stored with pending face detection
+    """
+    from rq import Retry
+
+    queue.enqueue(
+        run_face_pipeline, image_id,
+        retry=Retry(max=len(DETECTION_RETRY_INTERVALS), interval=DETECTION_RETRY_INTERVALS)
+    )
+
+
+def add_person_update(person_updates, person_id, thumbnail_url, face_encodings):
+    """
+    Record that an image was matched to a person.
+
+    Updates are aggregated per person so each person gets a single write.
+
+    Args:
+        person_updates: Dict of pending updates keyed by person ID
+        person_id: ID of the matched person
+        thumbnail_url: Thumbnail URL of the matched image
+        face_encodings: Face encodings detected in the image
+    """
+    person_update = person_updates.get(person_id)
+    if person_update is None:
+        person_update = person_updates[person_id] = {
+            'image_count': 0,
+            'thumbnail_url': thumbnail_url,
+            'face_encodings': []
+        }
+
+    person_update['image_count'] += 1
+
+    # Add face encoding to person if new
+    if face_encodings:
+        person_update['face_encodings'].append(face_encodings[0])
+
+
+def apply_person_updates(person_updates, now=None):
+    """
+    Write aggregated person updates with a single bulk write.
+
+    Args:
+        person_updates: Dict of pending updates from add_person_update
+        now: Timestamp for updated_at, defaults to the current time
+    """
+    if not person_updates:
+        return
+
+    now = now or datetime.utcnow()
+
+    person_ops = []
+    for person_id, person_update in person_updates.items():
+        update_ops = {
+            '$inc': {'image_count': person_update['image_count']},
+            '$set': {'updated_at': now}
+        }
+        if person_update['face_encodings']:
+            update_ops['$addToSet'] = {'face_encodings': {'$each': person_update['face_encodings']}}
+
+        person_ops.append(UpdateOne({'_id': person_id}, update_ops))
+
+        # Set thumbnail if not set, without reading the person first
+        person_ops.append(UpdateOne(
+            {'_id': person_id, 'thumbnail_url': None},
+            {'$set': {'thumbnail_url': person_update['thumbnail_url']}}
+        ))
+
+    mongo.db.people.bulk_write(person_ops, ordered=False)
+
+    if any(u['face_encodings'] for u in person_updates.values()):
+        bump_people_version()
+
+
+def process_image_faces(app, image_id, image_data, thumbnail_url, face_service, raise_errors=False):
+    """
+    Detect and match faces for an image stored with pending face detection.
+
+    Runs outside the request, so it pushes its own app context. When
+    detection fails the image stays pending with detection_error set, so
+    redetect_pending.py picks it up again.
+
+    Args:
+        app: Flask application
+        image_id: ID of the image document
+        image_data: Image file data
+        thumbnail_url: Thumbnail URL of the image
+        face_service: FaceRecognitionService used for detection and matching
+        raise_errors: Raise detection errors after recording them, so an RQ
+                      job fails and is retried
+    """
+    with app.app_context():
+        try:
+            face_result = face_service.detect_faces(image_data)
+            if not face_result['success']:
+                raise RuntimeError(face_result['error'])
+
+            face_encodings = face_result.get('face_encodings', [])
+            face_locations = face_result.get('face_locations', [])
+
+            matched_person_id = face_service.match_faces(face_encodings, get_people_index(face_service))
+            now = datetime.utcnow()
+
+            detection_data = {
+                'face_encodings': face_encodings,
+                'face_locations': face_locations,
+                'has_face': bool(face_encodings),
+                'updated_at': now
+            }
+
+            # Only write to an image that is still pending and unassigned, so a
+            # delete or manual assignment made meanwhile is never overwritten
+            result = mongo.db.images.update_one(
+                {'_id': image_id, 'has_face': None, 'person_id': None},
+                {
+                    '$set': {
+                        **detection_data,
+                        'person_id': matched_person_id,
+                        'is_identified': matched_person_id is not None
+                    },
+                    '$unset': {'detection_error': ''}
+                }
+            )
+
+            if result.matched_count != 1:
+                # Assigned while pending: keep the detected faces, not the match
+                mongo.db.images.update_one(
+                    {'_id': image_id, 'has_face': None},
+                    {'$set': detection_data, '$unset': {'detection_error': ''}}
+                )
+            elif matched_person_id:
+                person_updates = {}
+                add_person_update(person_updates, matched_person_id, thumbnail_url, face_encodings)
+                apply_person_updates(person_updates, now)
+
+            invalidate_stats_cache()
+
+        except Exception as e:
+            logger.error(f"Background face processing error for image {image_id}: {str(e)}")
+            mark_detection_failed(image_id, e)
+            if raise_errors:
+                raise
+
+
+def mark_detection_failed(image_id, error):
+    """
+    Record a failed detection on an image that is still pending.
+
+    The image keeps has_face set to None instead of being stored as having
+    no face, so it is detected again later.
+
+    Args:
+        image_id: ID of the image document
+        error: The detection error
+    """
+    mongo.db.images.update_one(
+        {'_id': image_id, 'has_face': None},
+        {'$set': {'detection_error': str(error), 'updated_at': datetime.utcnow()}}
+    )
+
+
+def detect_stored_image(app, image_id, raise_errors=False):
+    """
+    Download a stored image from Cloudinary and detect and match its faces.
+
+    Args:
+        app: Flask application
+        image_id: ID of an image stored with pending face detection
+        raise_errors: Raise errors after logging them, as in process_image_faces
+    """
+    with app.app_context():
+        image = mongo.db.images.find_one({'_id': image_id}, {'cloudinary_url': 1, 'thumbnail_url': 1})
+
+        if not image:
+            logger.error(f"Background face processing error for image {image_id}: image not found")
+            if raise_errors:
+                raise LookupError(f"Image {image_id} not found")
+            return
+
+        download_result = download_image(image['cloudinary_url'])
+        if not download_result['success']:
+            logger.error(f"Background face processing error for image {image_id}: {download_result['error']}")
+            mark_detection_failed(image_id, download_result['error'])
+            if raise_errors:
+                raise RuntimeError(download_result['error'])
+            return
+
+    process_image_faces(
+        app, image_id, download_result['data'],
+        image.get('thumbnail_url') or get_thumbnail_url(image['cloudinary_url']),
+        get_configured_face_service(app.config),
+        raise_errors
+    )
+
+
+def run_face_pipeline(image_id):
+    """
+    Detect and match faces for a stored image, as an RQ job.
+
+    Runs in an RQ worker started from the backend directory with
+    `rq worker --url <FACE_DETECTION_QUEUE_URL> face-detection`, so it creates
+    its own app and downloads the image from Cloudinary. Failures raise, so
+    RQ retries the job and keeps it in the failed job registry after that.
+
+    Args:
+        image_id: ID of an image stored with pending face detection
+    """
+    global _worker_app
+    if _worker_app is None:
+        from app import create_app
+        _worker_app = create_app()
+
+    detect_stored_image(_worker_app, image_id, raise_errors=True)
@@ -1,85 +1,535 @@
 """Face recognition service for detecting and matching faces."""
-import face_recognition
 import numpy as np
+from bson.binary import Binary
 from io import BytesIO
 from PIL import Image
 import logging
+import math
+import threading
 
 logger = logging.getLogger(__name__)
 
+ENCODING_SIZE = 128
+
+# Packed size of a quantized encoding: float32 scale + 128 int8 values
+QUANTIZED_SIZE = 4 + ENCODING_SIZE
+
+# Stored encodings above which FAISS uses an approximate HNSW graph
+HNSW_THRESHOLD = 10000
+HNSW_NEIGHBORS = 32
+HNSW_EF_SEARCH = 64
+
+# Images per batched CNN detection call. Each one is held on the GPU at
+# DETECTION_BATCH_IMAGE_SIZE, upsampled once, so larger batches risk running
+# out of GPU memory
+DETECTION_BATCH_SIZE = 8
+
+# Square size images are letterboxed to for batched CNN detection
+DETECTION_BATCH_IMAGE_SIZE = 640
+
+# Longest side images are downscaled to before detection
+MAX_IMAGE_SIZE = 1600
+
+try:
+    import faiss
+except ImportError:  # Optional, matching falls back to NumPy
+    faiss = None
+
+
+def pack_encoding(encoding):
+    """
+    Pack a face encoding into its storage format.
+    
+    Encodings are stored as BSON binary holding a float32 scale followed by
+    128 int8 values (132 bytes), scaled so the largest component maps to 127.
+    Rounding changes distances between encodings by a few thousandths, far
+    below the matching tolerance, and the encoding is about 8x smaller than
+    an array of 128 doubles.
+    
+    Args:
+        encoding: Face encoding (list, ndarray or stored binary)
+        
+    Returns:
+        Binary: Packed encoding
+    """
+    values = unpack_encoding(encoding)
+    scale = np.float32(np.abs(values).max() / 127) or np.float32(1)
+    quantized = np.clip(np.rint(values / scale), -127, 127).astype(np.int8)
+    return Binary(scale.tobytes() + quantized.tobytes())
+
+
+def unpack_encoding(encoding):
+    """
+    Unpack a stored face encoding into a float32 array.
+    
+    Args:
+        encoding: Packed int8 binary, float32 binary from before quantization,
+                  or a legacy list of floats
+        
+    Returns:
+        ndarray: Encoding of shape (128,)
+    """
+    if isinstance(encoding, bytes):
+        if len(encoding) == QUANTIZED_SIZE:
+            scale = np.frombuffer(encoding, dtype=np.float32, count=1)[0]
+            return np.frombuffer(encoding, dtype=np.int8, offset=4).astype(np.float32) * scale
+        return np.frombuffer(encoding, dtype=np.float32)
+    return np.asarray(encoding, dtype=np.float32)
+
+
+class EncodingIndex:
+    """Stored face encodings of all people, stacked for nearest-neighbour search."""
+    
+    def __init__(self, encodings, owner_ids, hnsw_threshold=HNSW_THRESHOLD):
+        """
+        Initialize the index.
+        
+        Args:
+            encodings: float32 matrix of stored encodings, shape (N, 128)
+            owner_ids: List of the N person IDs owning each encoding
+            hnsw_threshold: Number of encodings from which FAISS searches an
+                            approximate HNSW graph instead of scanning them all
+        """
+        self.encodings = encodings
+        self.owner_ids = owner_ids
+        self.squared_norms = np.einsum('ij,ij->i', encodings, encodings)
+        self.faiss_index = None
+        
+        if faiss is not None and owner_ids:
+            if len(owner_ids) >= hnsw_threshold:
+                self.faiss_index = faiss.IndexHNSWFlat(ENCODING_SIZE, HNSW_NEIGHBORS)
+                self.faiss_index.hnsw.efSearch = HNSW_EF_SEARCH
+            else:
+                self.faiss_index = faiss.IndexFlatL2(ENCODING_SIZE)
+            self.faiss_index.add(encodings)
+    
+    def __len__(self):
+        return len(self.owner_ids)
+    
+    def search(self, queries):
+        """
+        Find the nearest stored encoding for each query encoding.
+        
+        Uses FAISS when it is installed; both FAISS indexes return squared L2
+        distances. Otherwise squared distances are
+        computed as |q|^2 - 2 q.e + |e|^2 with the stored norms precomputed,
+        so the only per-query work is one BLAS matrix product.
+        
+        Args:
+            queries: float32 matrix of query encodings, shape (F, 128)
+            
+        Returns:
+            tuple: (indices of the nearest encodings, squared distances to them),
+                   both of shape (F,)
+        """
+        if self.faiss_index is not None:
+            distances, indices = self.faiss_index.search(queries, 1)
+            return indices[:, 0], distances[:, 0]
+        
+        # Squared distance from every query to every stored encoding, shape (F, N)
+        distances = queries @ self.encodings.T
+        distances *= -2
+        distances += self.squared_norms
+        distances += np.einsum('ij,ij->i', queries, queries)[:, None]
+        
+        best = distances.argmin(axis=1)
+        return best, distances[np.arange(len(queries)), best]
+
 
 class FaceRecognitionService:
     """Service for face detection and recognition."""
     
-    def __init__(self, tolerance=0.6):
+    def __init__(self, tolerance=0.6, hnsw_threshold=HNSW_THRESHOLD, model='hog',
+                 max_image_size=MAX_IMAGE_SIZE):
         """
         Initialize the face recognition service.
         
         Args:
             tolerance: How much distance between faces to consider it a match.
                       Lower is stricter. 0.6 is typical best performance.
+            hnsw_threshold: Stored encodings from which FAISS matching switches
+                            to an approximate HNSW index
+            model: Face detection model, 'hog' (CPU) or 'cnn' (GPU when dlib
+                   was built with CUDA)
+            max_image_size: Longest side in pixels images are downscaled to
+                            before detection, or 0 to keep full resolution
         """
         self.tolerance = tolerance
+        self.hnsw_threshold = hnsw_threshold
+        self.model = model
+        self.max_image_size = max_image_size
+        
+        # Index over all people's encodings and the people version it reflects
+        self._index = None
+        self._index_version = None
+        self._index_lock = threading.Lock()
+        # Decoded encodings per person, with the change stamp they were read at
+        self._person_encodings = {}
+        # Whether batched encoding was checked against face_recognition, and
+        # whether it is used
+        self._batch_encoding_checked = False
+        self._batch_encoding = True
     
     def detect_faces(self, image_data):
         """
         Detect faces in an image.
         
         Args:
-            image_data: Image file data (bytes or file-like object)
+            image_data: Image file data (bytes-like or file-like object)
             
         Returns:
-            dict: Contains face_encodings (list) and face_locations (list)
+            dict: Contains face_encodings (list of packed encodings) and
+                  face_locations (list)
         """
+        # Imported on first detection: loading dlib and its models is slow and
+        # only the upload and reprocess routes need it
+        import face_recognition
+        
         try:
-            # Load image
-            if isinstance(image_data, bytes):
-                image = face_recognition.load_image_file(BytesIO(image_data))
-            else:
-                image_data.seek(0)
-                image = face_recognition.load_image_file(image_data)
+            image, scale = self._load_image(image_data)
             
             # Detect face locations
-            face_locations = face_recognition.face_locations(image, model='hog')
+            face_locations = face_recognition.face_locations(image, model=self.model)
             
+            return self._encode_faces(face_recognition, image, face_locations, scale)
+            
+        except Exception as e:
+            return self._detection_error(e)
+    
+    def detect_faces_batch(self, images_data, batch_size=DETECTION_BATCH_SIZE):
+        """
+        Detect faces in several images.
+        
+        With the CNN model, images are letterboxed to one fixed square size
+        and run through dlib in batches, which keeps the GPU busy instead of
+        launching one small job per image. A batch that fails is detected
+        again one image at a time. HOG cannot batch, so each image is
+        detected on its own. Encodings for the faces of all images are then
+        computed in batched calls to dlib's face descriptor network, on the
+        images before letterboxing, or one image at a time when a batched
+        call fails.
+        
+        Args:
+            images_data: List of image file data
+            batch_size: Images per CNN and encoding batch
+            
+        Returns:
+            list: One detect_faces result per image, in order
+        """
+        import face_recognition
+        
+        results = [None] * len(images_data)
+        images = {}
+        scales = {}
+        locations = {}
+        
+        for position, image_data in enumerate(images_data):
+            try:
+                images[position], scales[position] = self._load_image(image_data)
+            except Exception as e:
+                results[position] = self._detection_error(e)
+        
+        if self.model == 'cnn':
+            loaded = list(images)
+            for start in range(0, len(loaded), batch_size):
+                positions = loaded[start:start + batch_size]
+                try:
+                    # batch_face_locations needs every image in a batch to be the same size
+                    boxed = [self._letterbox(images[position]) for position in positions]
+                    batch_locations = face_recognition.batch_face_locations(
+                        [canvas for canvas, _ in boxed],
+                        number_of_times_to_upsample=1,
+                        batch_size=len(positions)
+                    )
+                    for position, (_, factor), face_locations in zip(positions, boxed, batch_locations):
+                        locations[position] = self._unletterbox(face_locations, factor, images[position].shape)
+                except Exception as e:
+                    logger.warning(f"Batched face detection failed, detecting images one by one: {str(e)}")
+                    for position in positions:
+                        results[position] = self.detect_faces(images_data[position])
+        else:
+            for position, image in images.items():
+                try:
+                    locations[position] = face_recognition.face_locations(image, model=self.model)
+                except Exception as e:
+                    results[position] = self._detection_error(e)
+        
+        with_faces = [position for position, face_locations in locations.items() if face_locations]
+        for position, face_locations in locations.items():
             if not face_locations:
-                return {
-                    'success': True,
-                    'face_encodings': [],
-                    'face_locations': [],
-                    'face_count': 0
-                }
+                results[position] = self._detection_result([], [])
+        
+        for start in range(0, len(with_faces), batch_size):
+            positions = with_faces[start:start + batch_size]
+            batch_encodings = [None] * len(positions)
+            if self._batch_encoding:
+                try:
+                    batch_encodings = self._encode_faces_batch(
+                        face_recognition,
+                        [images[position] for position in positions],
+                        [locations[position] for position in positions]
+                    )
+                except Exception as e:
+                    logger.warning(f"Batched face encoding failed, encoding images one by one: {str(e)}")
             
-            # Get face encodings
-            face_encodings = face_recognition.face_encodings(image, face_locations)
+            for position, face_encodings in zip(positions, batch_encodings):
+                try:
+                    if face_encodings is None:
+                        face_encodings = face_recognition.face_encodings(images[position], locations[position])
+                    results[position] = self._detection_result(
+                        face_encodings, locations[position], scales[position]
+                    )
+                except Exception as e:
+                    results[position] = self._detection_error(e)
+        
+        return results
+    
+    def _load_image(self, image_data):
+        """
+        Decode image file data into an RGB array for detection.
+        
+        Images larger than max_image_size are downscaled first. JPEGs are
+        decoded at a reduced DCT scale when possible, which skips most of the
+        decoding work for large photos.
+        
+        Returns:
+            tuple: (RGB array, factor from array to original coordinates)
+        """
+        if isinstance(image_data, (bytes, bytearray, memoryview)):
+            image = Image.open(BytesIO(image_data))
+        else:
+            image_data.seek(0)
+            image = Image.open(image_data)
+        
+        width = image.width
+        if self.max_image_size and max(image.size) > self.max_image_size:
+            # draft only picks a DCT scale that covers the requested size in
+            # both dimensions, so ask for the target size, not a square
+            ratio = self.max_image_size / max(image.size)
+            image.draft('RGB', (math.ceil(image.width * ratio), math.ceil(image.height * ratio)))
+            image.thumbnail((self.max_image_size, self.max_image_size), Image.Resampling.LANCZOS)
+        
+        # A writable copy, like face_recognition.load_image_file returns
+        return np.array(image.convert('RGB')), width / image.width
+    
+    def _letterbox(self, image, size=DETECTION_BATCH_IMAGE_SIZE):
+        """
+        Fit an RGB array into a black size x size canvas at its top left.
+        
+        Returns:
+            tuple: (canvas, factor from canvas to array coordinates)
+        """
+        height, width = image.shape[:2]
+        ratio = min(size / width, size / height)
+        fitted = np.asarray(Image.fromarray(image).resize(
+            (max(1, min(size, round(width * ratio))), max(1, min(size, round(height * ratio)))),
+            Image.Resampling.BILINEAR
+        ))
+        
+        canvas = np.zeros((size, size, 3), dtype=np.uint8)
+        canvas[:fitted.shape[0], :fitted.shape[1]] = fitted
+        return canvas, width / fitted.shape[1]
+    
+    def _unletterbox(self, face_locations, factor, shape):
+        """Scale face locations from a letterboxed canvas back to the array, clipped to its bounds."""
+        height, width = shape[:2]
+        return [
+            (min(round(top * factor), height), min(round(right * factor), width),
+             min(round(bottom * factor), height), min(round(left * factor), width))
+            for top, right, bottom, left in face_locations
+        ]
+    
+    def _encode_faces(self, face_recognition, image, face_locations, scale=1):
+        """Encode the faces found in an image and build its detection result."""
+        if not face_locations:
+            return self._detection_result([], [])
+        
+        # Get face encodings
+        face_encodings = face_recognition.face_encodings(image, face_locations)
+        
+        return self._detection_result(face_encodings, face_locations, scale)
+    
+    def _encode_faces_batch(self, face_recognition, images, images_locations):
+        """
+        Encode the faces of several images with one descriptor network call.
+        
+        face_recognition only exposes per-image encoding, so this uses its
+        private landmark predictor and encoder directly with dlib's batch
+        overload of compute_face_descriptor. The first batch is checked
+        against face_recognition.face_encodings; if they differ, for example
+        after a face_recognition upgrade, batching is turned off.
+        
+        Args:
+            face_recognition: The face_recognition module
+            images: RGB arrays
+            images_locations: Face locations found in each image
             
-            # Convert to serializable format
-            encodings_list = [encoding.tolist() for encoding in face_encodings]
-            locations_list = [list(loc) for loc in face_locations]
+        Returns:
+            list: Face encodings for each image, in order, or None for each
+                  image when batching was turned off
+        """
+        import dlib
+        from face_recognition import api
+        
+        batch_landmarks = []
+        for image, face_locations in zip(images, images_locations):
+            landmarks = dlib.full_object_detections()
+            for face_landmarks in api._raw_face_landmarks(image, face_locations, model='small'):
+                landmarks.append(face_landmarks)
+            batch_landmarks.append(landmarks)
+        
+        descriptors = api.face_encoder.compute_face_descriptor(images, batch_landmarks, 1)
+        batch_encodings = [
+            [np.array(descriptor) for descriptor in image_descriptors] for image_descriptors in descriptors
+        ]
+        
+        if not self._batch_encoding_checked:
+            expected = face_recognition.face_encodings(images[0], images_locations[0])
+            if len(expected) != len(batch_encodings[0]) or not np.allclose(expected, batch_encodings[0], atol=1e-5):
+                logger.warning('Batched face encodings differ from face_recognition, encoding images one by one')
+                self._batch_encoding = False
+                return [None] * len(images)
+            self._batch_encoding_checked = True
+        
+        return batch_encodings
+    
+    def _detection_result(self, face_encodings, face_locations, scale=1):
+        """Build the detection result for encoded faces at array coordinates."""
+        # Convert to storable format
+        encodings_list = [pack_encoding(encoding) for encoding in face_encodings]
+        locations_list = [[round(value * scale) for value in loc] for loc in face_locations]
+        
+        return {
+            'success': True,
+            'face_encodings': encodings_list,
+            'face_locations': locations_list,
+            'face_count': len(face_locations)
+        }
+    
+    def _detection_error(self, error):
+        """Log a detection failure and build an empty result for it."""
+        logger.error(f"Face detection error: {str(error)}")
+        return {
+            'success': False,
+            'error': str(error),
+            'face_encodings': [],
+            'face_locations': [],
+            'face_count': 0
+        }
+    
+    def build_index(self, people):
+        """
+        Stack every stored encoding into a single index for batch matching.
+        
+        Args:
+            people: List of person documents with face_encodings
             
-            return {
-                'success': True,
-                'face_encodings': encodings_list,
-                'face_locations': locations_list,
-                'face_count': len(face_locations)
-            }
+        Returns:
+            EncodingIndex: Index over all stored encodings
+        """
+        return self._stack_index((person['_id'], self._decode_person(person)) for person in people)
+    
+    def rebuild_index(self, stamps, load_people, version=None):
+        """
+        Rebuild the cached index, decoding only people whose encodings changed.
+        
+        Args:
+            stamps: Dict of a change stamp for every person with encodings,
+                    keyed by person ID
+            load_people: Callable taking a list of person IDs and returning
+                         their documents with face_encodings
+            version: People version the stamps were read at
             
-        except Exception as e:
-            logger.error(f"Face detection error: {str(e)}")
-            return {
-                'success': False,
-                'error': str(e),
-                'face_encodings': [],
-                'face_locations': [],
-                'face_count': 0
-            }
+        Returns:
+            EncodingIndex: The new index
+        """
+        decoded = {
+            person_id: entry for person_id, entry in self._person_encodings.items()
+            if stamps.get(person_id) == entry[0]
+        }
+        
+        stale_ids = [person_id for person_id in stamps if person_id not in decoded]
+        if stale_ids:
+            for person in load_people(stale_ids):
+                decoded[person['_id']] = (stamps[person['_id']], self._decode_person(person))
+        
+        index = self._stack_index((person_id, encodings) for person_id, (_, encodings) in decoded.items())
+        self._person_encodings = decoded
+        self._index = index
+        self._index_version = version
+        return index
+    
+    def get_index(self, version, load_stamps, load_people):
+        """
+        Get the cached index, rebuilding it when the people version changed.
+        
+        Args:
+            version: Current people version
+            load_stamps: Callable returning the stamps for rebuild_index
+            load_people: Callable returning person documents by ID
+            
+        Returns:
+            EncodingIndex: Index over all stored encodings
+        """
+        with self._index_lock:
+            if self._index is None or self._index_version != version:
+                return self.rebuild_index(load_stamps(), load_people, version)
+            return self._index
+    
+    def _decode_person(self, person):
+        """Decode a person's stored encodings into a float32 matrix of shape (K, 128)."""
+        encodings = [unpack_encoding(encoding) for encoding in person.get('face_encodings', []) if encoding]
+        if not encodings:
+            return np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        return np.stack(encodings)
+    
+    def _stack_index(self, person_encodings):
+        """Build an EncodingIndex from (person ID, encoding matrix) pairs."""
+        blocks = []
+        owner_ids = []
+        
+        for person_id, encodings in person_encodings:
+            blocks.append(encodings)
+            owner_ids.extend([person_id] * len(encodings))
+        
+        if not owner_ids:
+            return EncodingIndex(np.empty((0, ENCODING_SIZE), dtype=np.float32), owner_ids)
+        
+        return EncodingIndex(np.concatenate(blocks), owner_ids, self.hnsw_threshold)
+    
+    def match_faces(self, face_encodings, index):
+        """
+        Find the person matching the first recognisable face in an image.
+        
+        All faces are searched against the index in one batch.
+        
+        Args:
+            face_encodings: Face encodings detected in the image (list)
+            index: EncodingIndex from build_index
+            
+        Returns:
+            ObjectId or None: The matched person's ID or None
+        """
+        if not face_encodings or not len(index):
+            return None
+        
+        queries = np.stack([unpack_encoding(encoding) for encoding in face_encodings])
+        best, best_distances = index.search(queries)
+        
+        # Faces are checked in detection order, so the first match wins
+        max_distance = self.tolerance ** 2
+        for face_index, distance in enumerate(best_distances):
+            if distance < max_distance:
+                return index.owner_ids[best[face_index]]
+        
+        return None
     
     def find_matching_person(self, face_encoding, people):
         """
         Find a matching person for a face encoding.
         
         Args:
-            face_encoding: The face encoding to match (list)
+            face_encoding: The face encoding to match (list or packed)
             people: List of person documents with face_encodings
             
         Returns:
@@ -88,42 +538,22 @@ class FaceRecognitionService:
         if not face_encoding or not people:
             return None
         
-        target_encoding = np.array(face_encoding)
-        best_match = None
-        best_distance = float('inf')
-        
-        for person in people:
-            person_encodings = person.get('face_encodings', [])
-            
-            for stored_encoding in person_encodings:
-                if not stored_encoding:
-                    continue
-                    
-                stored_np = np.array(stored_encoding)
-                
-                # Calculate face distance
-                distance = np.linalg.norm(target_encoding - stored_np)
-                
-                if distance < self.tolerance and distance < best_distance:
-                    best_distance = distance
-                    best_match = person['_id']
-        
-        return best_match
+        return self.match_faces([face_encoding], self.build_index(people))
     
     def compare_faces(self, encoding1, encoding2):
         """
         Compare two face encodings.
         
         Args:
-            encoding1: First face encoding (list)
-            encoding2: Second face encoding (list)
+            encoding1: First face encoding (list or packed)
+            encoding2: Second face encoding (list or packed)
             
         Returns:
             dict: Contains 'match' (bool) and 'distance' (float)
         """
         try:
-            enc1 = np.array(encoding1)
-            enc2 = np.array(encoding2)
+            enc1 = unpack_encoding(encoding1)
+            enc2 = unpack_encoding(encoding2)
             
             distance = np.linalg.norm(enc1 - enc2)
             is_match = distance <= self.tolerance
@@ -145,11 +575,16 @@ class FaceRecognitionService:
 
 # Global service instance
 face_service = None
+_face_service_lock = threading.Lock()
 
 
-def get_face_service(tolerance=0.6):
+def get_face_service(tolerance=0.6, hnsw_threshold=HNSW_THRESHOLD, model='hog',
+                     max_image_size=MAX_IMAGE_SIZE):
     """Get or create the face recognition service instance."""
     global face_service
     if face_service is None:
-        face_service = FaceRecognitionService(tolerance)
+        # Concurrent first requests must not build two services and indexes
+        with _face_service_lock:
+            if face_service is None:
+                face_service = FaceRecognitionService(tolerance, hnsw_threshold, model, max_image_size)
     return face_service
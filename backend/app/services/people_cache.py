@@ -0,0 +1,61 @@
+"""Version tracking for the people encoding index cached on the face service."""
+from app import mongo
+
+PEOPLE_VERSION_ID = 'people_version'
+
+
+def bump_people_version():
+    """
+    Mark cached people encodings as stale.
+
+    Must be called after any write that adds, changes or removes a person's
+    face_encodings, including deleting the person.
+    """
+    mongo.db.counters.update_one(
+        {'_id': PEOPLE_VERSION_ID},
+        {'$inc': {'value': 1}},
+        upsert=True
+    )
+
+
+def get_people_version():
+    """Get the current people version counter."""
+    counter = mongo.db.counters.find_one({'_id': PEOPLE_VERSION_ID})
+    return counter.get('value', 0) if counter else 0
+
+
+def _load_people_stamps():
+    """
+    Get a change stamp for every person with encodings.
+
+    Encodings are only ever added, always together with an updated_at bump,
+    so updated_at and the number of encodings identify a person's encodings.
+    """
+    return {
+        person['_id']: (person.get('updated_at'), person['encoding_count'])
+        for person in mongo.db.people.aggregate([
+            {'$match': {'face_encodings.0': {'$exists': True}}},
+            {'$project': {'updated_at': 1, 'encoding_count': {'$size': '$face_encodings'}}}
+        ])
+    }
+
+
+def _load_people(person_ids):
+    """Get the encodings of the given people."""
+    return mongo.db.people.find({'_id': {'$in': person_ids}}, {'face_encodings': 1})
+
+
+def get_people_index(face_service):
+    """
+    Get the encoding index for all people, rebuilding it only when people change.
+
+    A rebuild only fetches and decodes the encodings of people that changed
+    since the last one.
+
+    Args:
+        face_service: FaceRecognitionService holding the cached index
+
+    Returns:
+        EncodingIndex: Index over all stored encodings
+    """
+    return face_service.get_index(get_people_version(), _load_people_stamps, _load_people)
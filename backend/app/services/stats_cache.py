@@ -0,0 +1,40 @@
+"""Response caching for the dashboard statistics routes."""
+from app import cache
+
+# Cache key and timeout in seconds for each stats route
+STATS_CACHE_TIMEOUTS = {
+    'stats:global': 60,
+    'stats:recent': 30,
+    'stats:unidentified': 30,
+    'stats:people-summary': 300
+}
+
+
+def _is_ok(response):
+    """Only cache successful responses, not (response, status) error tuples."""
+    return getattr(response, 'status_code', None) == 200
+
+
+def cached_stats(key):
+    """
+    Cache a stats view's response under a fixed key.
+
+    Args:
+        key: One of STATS_CACHE_TIMEOUTS
+
+    Returns:
+        Decorator for the view
+    """
+    return cache.cached(timeout=STATS_CACHE_TIMEOUTS[key], key_prefix=key, response_filter=_is_ok)
+
+
+def invalidate_stats_cache():
+    """
+    Drop every cached stats response.
+
+    Must be called after any write that adds, removes or reassigns images or
+    people.
+    """
+    # delete_many stops at the first key that is not cached, so delete each
+    for key in STATS_CACHE_TIMEOUTS:
+        cache.delete(key)
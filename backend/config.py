@@ -9,6 +9,13 @@ class Config:
     """Base configuration."""
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key')
     MONGO_URI = os.environ.get('MONGODB_URI')
+    CREATE_INDEXES = os.environ.get('CREATE_INDEXES', 'true').lower() == 'true'
+    
+    # Response cache for the stats routes. It must be shared by every web and
+    # RQ worker process for invalidation to reach them all, so it is Redis
+    # when CACHE_REDIS_URL is set and disabled otherwise
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'RedisCache' if CACHE_REDIS_URL else 'NullCache')
     
     # Cloudinary settings
     CLOUDINARY_CLOUD_NAME = os.environ.get('CLOUDINARY_CLOUD_NAME')
@@ -17,6 +24,31 @@ class Config:
     
     # Face recognition settings
     FACE_RECOGNITION_TOLERANCE = float(os.environ.get('FACE_RECOGNITION_TOLERANCE', 0.6))
+    # Stored encodings from which FAISS matching uses an approximate HNSW index
+    FACE_INDEX_HNSW_THRESHOLD = int(os.environ.get('FACE_INDEX_HNSW_THRESHOLD', 10000))
+    # 'hog' runs on the CPU; 'cnn' is batched and uses the GPU when dlib has CUDA
+    FACE_DETECTION_MODEL = os.environ.get('FACE_DETECTION_MODEL', 'hog')
+    # Longest side images are downscaled to before detection (0 keeps full size)
+    FACE_DETECTION_MAX_IMAGE_SIZE = int(os.environ.get('FACE_DETECTION_MAX_IMAGE_SIZE', 1600))
+    FACE_DETECTION_POOL_SIZE = int(os.environ.get('FACE_DETECTION_POOL_SIZE', os.cpu_count() or 1))
+    # Detect faces after responding to uploads instead of during the request
+    FACE_DETECTION_ASYNC = os.environ.get('FACE_DETECTION_ASYNC', 'false').lower() == 'true'
+    # Redis URL of an RQ queue for async detection; unset runs it in the web process
+    FACE_DETECTION_QUEUE_URL = os.environ.get('FACE_DETECTION_QUEUE_URL')
+    
+    # Concurrent Cloudinary uploads per worker process
+    UPLOAD_POOL_SIZE = int(os.environ.get('UPLOAD_POOL_SIZE', 8))
+    
+    # MongoDB connection pool, per worker process. A sync gunicorn worker runs
+    # one request at a time plus up to FACE_DETECTION_POOL_SIZE background
+    # detection threads writing results, so the default covers those with a
+    # little headroom; the server sees workers x MONGO_MAX_POOL_SIZE at most
+    MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', FACE_DETECTION_POOL_SIZE + 4))
+    MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 1))
+    # Fail fast instead of queueing requests when the pool is exhausted
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000))
+    MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 60000))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
     
     # File upload settings
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
@@ -36,6 +68,8 @@ class ProductionConfig(Config):
 class TestingConfig(Config):
     """Testing configuration."""
     TESTING = True
+    CREATE_INDEXES = False
+    CACHE_TYPE = 'NullCache'
 
 
 config = {
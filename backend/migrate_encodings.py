@@ -0,0 +1,54 @@
+"""One-shot migration of stored face encodings to packed int8 binary.
+
+Run from the backend directory with the usual environment configured:
+
+    python migrate_encodings.py
+"""
+from datetime import datetime
+from pymongo import UpdateOne
+
+from app import create_app, mongo
+from app.services.face_recognition_service import QUANTIZED_SIZE, pack_encoding
+from app.services.people_cache import bump_people_version
+
+# Documents with any stored encoding; packed encodings are left untouched
+ENCODED_QUERY = {'face_encodings.0': {'$exists': True}}
+
+
+def migrate_collection(collection):
+    """Pack every legacy encoding in a collection and return the number of documents updated."""
+    now = datetime.utcnow()
+    ops = []
+    for doc in collection.find(ENCODED_QUERY, {'face_encodings': 1}):
+        if all(isinstance(e, bytes) and len(e) == QUANTIZED_SIZE for e in doc['face_encodings']):
+            continue
+        ops.append(UpdateOne(
+            {'_id': doc['_id']},
+            # updated_at marks the person's cached decoded encodings as stale
+            {'$set': {
+                'face_encodings': [pack_encoding(e) for e in doc['face_encodings']],
+                'updated_at': now
+            }}
+        ))
+
+    if not ops:
+        return 0
+
+    return collection.bulk_write(ops, ordered=False).modified_count
+
+
+def main():
+    app = create_app()
+
+    with app.app_context():
+        people = migrate_collection(mongo.db.people)
+        images = migrate_collection(mongo.db.images)
+
+        if people:
+            bump_people_version()
+
+    print(f'Migrated encodings for {people} people and {images} images')
+
+
+if __name__ == '__main__':
+    main()
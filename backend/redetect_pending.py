@@ -0,0 +1,47 @@
+"""Detect faces again for images left pending by a lost background job.
+
+Background detection runs in a web worker's thread pool or on the RQ queue,
+and a worker restart or timeout drops its tasks, leaving images with has_face
+set to None. Failed detections stay pending too. Run this from the backend
+directory with the usual environment configured, for example from cron:
+
+    python redetect_pending.py [--minutes 30]
+
+Images pending for longer than the given number of minutes are queued again
+on FACE_DETECTION_QUEUE_URL when set, otherwise detected in this process.
+"""
+import argparse
+from datetime import datetime, timedelta
+
+from app import create_app, mongo
+from app.services.face_pipeline import detect_stored_image, enqueue_face_detection, get_detection_queue
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--minutes', type=int, default=30,
+                        help='Only redetect images pending for longer than this')
+    args = parser.parse_args()
+
+    app = create_app()
+
+    with app.app_context():
+        cutoff = datetime.utcnow() - timedelta(minutes=args.minutes)
+        image_ids = [
+            image['_id']
+            for image in mongo.db.images.find({'has_face': None, 'updated_at': {'$lt': cutoff}}, {'_id': 1})
+        ]
+        queue = get_detection_queue(app.config)
+
+    for image_id in image_ids:
+        if queue is not None:
+            enqueue_face_detection(queue, image_id)
+        else:
+            detect_stored_image(app, image_id)
+
+    action = 'Queued' if queue is not None else 'Ran'
+    print(f'{action} face detection for {len(image_ids)} pending images')
+
+
+if __name__ == '__main__':
+    main()